@@ -16,151 +16,328 @@ import os
 import subprocess
 import sys
 import threading
-import site
-import tempfile
+import concurrent.futures
+import select
+import queue
+import signal
+import re
+import collections
+import itertools
+import importlib.util
 import time
-import json
-import requests
-import fal.apps
-from pathlib import Path
-import bpy.utils.previews
-import bmesh
+from mathutils import Matrix, Vector
+
+
+# pip output lines that mark a step of the installation, and the file or
+# link each step refers to
+_PIP_STATUS_RE = re.compile(r'^\s*(Collecting|Downloading|Using cached|Installing collected packages:)\s*(\S*)')
+# Download progress printed by pip's "--progress-bar raw" (pip 24.1+)
+_PIP_RAW_PROGRESS_RE = re.compile(r'^Progress (\d+) of (\d+)')
+
+# Messages from the install threads to the main-thread monitor timer:
+# ('progress', percent) or ('final', success, install_log)
+_progress_q = queue.SimpleQueue()
+
+# Worker threads for background work such as the install task,
+# created in register() and shut down in unregister()
+_executor = None
+# Future of the current (or last) install task; it outlives file loads
+_install_future = None
 
 
 # Setup logging
-def log_debug(message):
-    """Log debug messages to console and store in scene property"""
-    print(f"[FAL_DEBUG] {message}")
-    # Store in scene property if available
+# Console and buffer prefixes for each log level
+_LOG_PREFIXES = {
+    level: (f"[FAL_{level}] ", f"[{level}] ")
+    for level in ("DEBUG", "INFO", "ERROR", "PIP")
+}
+# Most recent debug log lines, joined into text only when requested
+_debug_log = collections.deque(maxlen=2000)
+# True while the addon's scene properties are registered
+_props_ready = False
+# Whether fal is installed, checked at register() and after an install
+_fal_installed = False
+# Full log of the current session on disk, open between register() and unregister()
+_log_file = None
+# Session logs kept in the log folder, including the current one
+_LOG_FILES_KEPT = 5
+# Latest UI status message, copied to the scene by _flush_status()
+_status_message = ""
+_status_dirty = False
+_status_timer_pending = False
+
+
+def get_debug_log(max_lines=None):
+    """Return the buffered debug log (optionally only its last lines) as a single string"""
+    if max_lines is None or max_lines >= len(_debug_log):
+        return "\n".join(_debug_log)
+    return "\n".join(itertools.islice(_debug_log, len(_debug_log) - max_lines, None))
+
+
+def _log(level, message, status=None):
+    """Print a message, buffer it and optionally show it as the UI status"""
+    global _status_message, _status_dirty, _status_timer_pending
+    console_prefix, buffer_prefix = _LOG_PREFIXES[level]
+    print(console_prefix + message)
+    line = buffer_prefix + message
+    _debug_log.append(line)
+    # Read once: unregister() may detach the file while another thread logs
+    log_file = _log_file
+    if log_file is not None:
+        try:
+            log_file.write(line + "\n")
+            # Debug and pip lines stay buffered; info and errors go out now
+            if level in ("INFO", "ERROR"):
+                log_file.flush()
+        except ValueError:
+            # Closed by unregister() after we read it
+            pass
+    if status is None:
+        return
+    _status_message = status
+    _status_dirty = True
+    # Timers may only be registered from the main thread; while installing,
+    # the install monitor flushes messages logged by the worker thread
+    if (_props_ready and not _status_timer_pending
+            and threading.current_thread() is threading.main_thread()):
+        _status_timer_pending = True
+        # Persistent, so a file load before it fires can't leave the flag set
+        bpy.app.timers.register(_flush_status_timer, first_interval=0.1, persistent=True)
+
+
+def _flush_status():
+    """Copy the latest status message to the scene (main thread only)"""
+    global _status_dirty
+    # Scene properties only exist between register() and unregister()
+    if _status_dirty and _props_ready:
+        bpy.context.scene.fal_status_message = _status_message
+        _status_dirty = False
+    return None
+
+
+def _flush_status_timer():
+    """One-shot timer scheduled by _log() to flush the status message"""
+    global _status_timer_pending
+    _status_timer_pending = False
+    return _flush_status()
+
+
+def _prune_debug_logs(log_dir):
+    """Delete debug logs of older sessions, leaving room for a new one"""
     try:
-        if hasattr(bpy.context.scene, "fal_debug_log"):
-            current_log = bpy.context.scene.fal_debug_log
-            bpy.context.scene.fal_debug_log = f"{current_log}\n[DEBUG] {message}"
-    except:
-        pass
+        paths = [
+            os.path.join(log_dir, name)
+            for name in os.listdir(log_dir)
+            if name.startswith("fal_debug_") and name.endswith(".log")
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+    for path in paths[_LOG_FILES_KEPT - 1:]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Still open in another Blender instance on Windows
+            pass
+
+
+def log_debug(message):
+    """Log debug messages to console and the debug log buffer"""
+    _log("DEBUG", message)
 
 
 def log_info(message):
-    """Log info messages to console, UI, and store in scene property"""
-    print(f"[FAL_INFO] {message}")
-    # Store in scene property if available
-    try:
-        if hasattr(bpy.context.scene, "fal_debug_log"):
-            current_log = bpy.context.scene.fal_debug_log
-            bpy.context.scene.fal_debug_log = f"{current_log}\n[INFO] {message}"
-    except:
-        pass
-    # Update UI message if available
-    try:
-        bpy.context.scene.fal_status_message = message
-    except:
-        pass
+    """Log info messages to console, UI, and the debug log buffer"""
+    _log("INFO", message, status=message)
 
 
 def log_error(message):
-    """Log error messages to console, UI, and store in scene property"""
-    print(f"[FAL_ERROR] {message}")
-    # Store in scene property if available
-    try:
-        if hasattr(bpy.context.scene, "fal_debug_log"):
-            current_log = bpy.context.scene.fal_debug_log
-            bpy.context.scene.fal_debug_log = f"{current_log}\n[ERROR] {message}"
-    except:
-        pass
-    # Update UI message if available
-    try:
-        bpy.context.scene.fal_status_message = f"ERROR: {message}"
-    except:
-        pass
+    """Log error messages to console, UI, and the debug log buffer"""
+    _log("ERROR", message, status=f"ERROR: {message}")
 
 
 class FALPackageChecker:
+    # Last line of pip output, set by the reader thread
+    latest_line = ""
+    # Log lines copied to fal_install_log when an install finishes, capped
+    # in size since the property is saved in the .blend and copied on undo
+    _INSTALL_LOG_LINES = 200
+    _MAX_LOG_BYTES = 8192
+    # Progress derived from pip's output (0-90, the rest is set on completion)
+    progress = 0
+    _packages_seen = 0
+    _packages_fetched = 0
+    _download_fraction = 0.0
+    # True while pip is fetching a counted package file
+    _fetch_active = False
+    # pip line shown by the panel when it was last redrawn
+    _shown_line = ""
+    # Set by FAL_OT_CancelInstall to stop a running installation
+    _cancel_flag = threading.Event()
+    # Install target, resolved once in register()
+    _install_target = ""
+    _target_writable = False
+    # pip --progress-bar mode, "raw" when the bundled pip supports it;
+    # resolved by the first install
+    _progress_bar = None
+    # Monitor timer interval while messages arrive / while the queue is idle
+    _BUSY_INTERVAL = 0.05
+    _IDLE_INTERVAL = 0.5
+    
     @staticmethod
     def is_package_installed():
         """Check if fal package is installed in Blender's Python environment."""
         log_debug("Checking if fal package is installed...")
-        try:
-            import fal
-            log_debug(f"FAL package found: {fal.__file__}")
-            return True
-        except ImportError as e:
-            log_debug(f"FAL package not found: {str(e)}")
-            return False
+        # Locate the package without executing it
+        spec = importlib.util.find_spec("fal")
+        if spec is not None:
+            log_debug(f"FAL package found: {spec.origin}")
+        else:
+            log_debug("FAL package not found")
+        return spec is not None
     
     @staticmethod
     def install_package():
-        """Start installation in a monitoring thread."""
-        log_debug("Starting FAL package installation process")
-        
-        # Reset progress indicators
-        bpy.context.scene.fal_install_progress = 0
-        bpy.context.scene.fal_install_in_progress = True
-        bpy.context.scene.fal_install_log = ""
-        bpy.context.scene.fal_install_success = False
+        """Start installation on a worker thread and return its future.
         
-        # Start the installation thread
-        install_thread = threading.Thread(target=FALPackageChecker._install_process)
-        install_thread.daemon = True
-        install_thread.start()
+        If an install is still running (loading a file removes the monitor
+        but not the worker), show that one again instead of starting pip twice.
+        """
+        global _install_future
+        if _install_future is not None and not _install_future.done():
+            log_debug("FAL package installation already running, resuming monitor")
+            bpy.context.scene.fal_install_progress = FALPackageChecker.progress
+            bpy.context.scene.fal_install_in_progress = True
+        else:
+            log_debug("Starting FAL package installation process")
+            
+            # Reset progress indicators
+            bpy.context.scene.fal_install_progress = 0
+            bpy.context.scene.fal_install_in_progress = True
+            bpy.context.scene.fal_install_log = ""
+            bpy.context.scene.fal_install_success = False
+            FALPackageChecker._cancel_flag.clear()
+            
+            # Drop messages from a finished run whose monitor was removed
+            while True:
+                try:
+                    _progress_q.get_nowait()
+                except queue.Empty:
+                    break
+            
+            # Start the installation on a worker thread
+            _install_future = _executor.submit(
+                FALPackageChecker._install_process,
+                bpy.context.scene.fal_verbose_install
+            )
+            _install_future.add_done_callback(FALPackageChecker._install_done)
         
         # Start the monitoring timer
         if not bpy.app.timers.is_registered(FALPackageChecker._monitor_installation):
-            bpy.app.timers.register(FALPackageChecker._monitor_installation, first_interval=0.5)
+            bpy.app.timers.register(
+                FALPackageChecker._monitor_installation,
+                first_interval=FALPackageChecker._BUSY_INTERVAL
+            )
             
         log_info("Installing FAL package... This may take a moment.")
-        return install_thread
+        return _install_future
     
     @staticmethod
-    def _install_process():
+    def _install_done(future):
+        """Make sure the monitor finishes even if the install task crashed."""
+        error = future.exception()
+        if error is not None:
+            log_error(f"Installation task failed: {str(error)}")
+            _progress_q.put(('final', False, get_debug_log(max_lines=FALPackageChecker._INSTALL_LOG_LINES)))
+    
+    @staticmethod
+    def _install_process(verbose=False):
         """Actual installation process running in a separate thread."""
+        global _fal_installed
         log_debug("Installation thread started")
         
-        # Use a temporary file to capture pip's output
-        with tempfile.NamedTemporaryFile(delete=False, mode='w+', suffix='.txt') as temp_file:
-            log_path = temp_file.name
-            log_debug(f"Created temporary log file: {log_path}")
-        
-        site_packages = site.getsitepackages()[0]
+        install_target = FALPackageChecker._install_target
         python_exe = sys.executable
         
         log_debug(f"Using Python executable: {python_exe}")
-        log_debug(f"Installing to site-packages: {site_packages}")
+        log_debug(f"Installing to: {install_target}")
+        
+        if FALPackageChecker._progress_bar is None:
+            FALPackageChecker._progress_bar = "raw" if _pip_supports_raw_progress() else "off"
         
-        # Install package directly to Blender's site-packages
-        cmd = [python_exe, "-m", "pip", "install", "fal", "--target", site_packages, "--verbose"]
+        # Install into Blender's user modules folder
+        # Keep pip's output to plain, parseable lines
+        cmd = [
+            python_exe, "-u", "-m", "pip", "install",
+            "--upgrade",
+            "--target", install_target,
+            "--no-warn-script-location",
+            "--no-input",
+            "--disable-pip-version-check",
+            "--progress-bar", FALPackageChecker._progress_bar,
+            "--no-color",
+            "fal"
+        ]
+        if verbose:
+            cmd.append("--verbose")
         log_debug(f"Running command: {' '.join(cmd)}")
         
+        env = os.environ.copy()
+        env["PYTHONUNBUFFERED"] = "1"
+        env["PIP_NO_COLOR"] = "1"
+        env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+        
+        # Start pip in its own process group so cancelling also stops its children
+        if os.name == 'nt':
+            group_kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group_kwargs = {"start_new_session": True}
+        
+        # Reset output and progress from any previous run
+        FALPackageChecker.latest_line = ""
+        FALPackageChecker.progress = 0
+        FALPackageChecker._packages_seen = 0
+        FALPackageChecker._packages_fetched = 0
+        FALPackageChecker._download_fraction = 0.0
+        FALPackageChecker._fetch_active = False
+        
         try:
-            # Redirect both stdout and stderr to our log file
-            with open(log_path, 'w') as log_file:
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=log_file,
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True
-                )
-                
-                # Store the process for monitoring
-                bpy.context.scene.fal_install_pid = process.pid
-                log_debug(f"Started pip process with PID: {process.pid}")
-                
-                # Wait for process to complete
-                process.wait()
-                log_debug(f"Pip process completed with return code: {process.returncode}")
+            # Pipe stdout and stderr so output is available as it arrives
+            # No stdin, so any interactive prompt fails instead of hanging
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=1,
+                universal_newlines=True,
+                env=env,
+                **group_kwargs
+            )
             
-            # Check if installation was successful
-            success = process.returncode == 0
+            log_debug(f"Started pip process with PID: {process.pid}")
             
-            # Read the output
-            with open(log_path, 'r') as log_file:
-                output = log_file.read()
-                log_debug(f"Captured {len(output)} bytes of log output")
+            # The reader gets its own thread: queued behind busy pool workers
+            # it would leave pip blocked on a full pipe while we wait for it
+            reader = threading.Thread(
+                target=FALPackageChecker._read_output,
+                args=(process.stdout,),
+                name="fal-pip-reader",
+                daemon=True
+            )
+            reader.start()
             
-            # Store the results
-            bpy.context.scene.fal_install_log = output
-            bpy.context.scene.fal_install_success = success
+            FALPackageChecker._wait_for_process(process)
+            reader.join(timeout=5)
+            log_debug(f"Pip process completed with return code: {process.returncode}")
+            
+            # Check if installation was successful
+            success = process.returncode == 0
             
             if success:
+                # Re-check the package now that pip has written it
+                importlib.invalidate_caches()
+                _fal_installed = FALPackageChecker.is_package_installed()
                 log_info("FAL package installation completed successfully!")
             else:
                 log_error(f"FAL package installation failed with code {process.returncode}")
@@ -168,45 +345,216 @@ class FALPackageChecker:
         except Exception as e:
             error_msg = f"Exception during installation: {str(e)}"
             log_error(error_msg)
-            bpy.context.scene.fal_install_log = error_msg
-            bpy.context.scene.fal_install_success = False
+            success = False
+        
+        # The log buffer already holds pip's output; its tail is the install log
+        install_log = get_debug_log(max_lines=FALPackageChecker._INSTALL_LOG_LINES)
+        encoded = install_log.encode()
+        if len(encoded) > FALPackageChecker._MAX_LOG_BYTES:
+            # Keep the end of the log, starting at a whole line; non-ASCII
+            # output takes several bytes per character, so cut the encoding
+            tail = encoded[-FALPackageChecker._MAX_LOG_BYTES:]
+            _, newline, rest = tail.partition(b"\n")
+            install_log = (rest if newline else tail).decode(errors='ignore')
         
-        # Mark installation as complete
-        bpy.context.scene.fal_install_in_progress = False
-        bpy.context.scene.fal_install_progress = 100 if bpy.context.scene.fal_install_success else 0
+        # Hand the results to the main thread in one message
+        _progress_q.put(('final', success, install_log))
+    
+    @staticmethod
+    def _set_progress(progress):
+        """Send the progress estimate to the main thread if it increased."""
+        # Each new "Collecting" line lowers the estimate; never move the bar back
+        if progress > FALPackageChecker.progress:
+            FALPackageChecker.progress = progress
+            _progress_q.put(('progress', progress))
+    
+    @staticmethod
+    def _wait_for_process(process):
+        """Wait for pip to exit, terminating it if the user cancels."""
+        # A pidfd lets us sleep until the process exits (Linux only)
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            pidfd = None
         
-        # Clean up temp file after a delay
         try:
-            time.sleep(1)  # Make sure file is not in use
-            os.unlink(log_path)
-            log_debug(f"Removed temporary log file: {log_path}")
-        except Exception as e:
-            log_debug(f"Failed to remove temp file: {str(e)}")
+            while process.poll() is None:
+                if FALPackageChecker._cancel_flag.is_set():
+                    log_debug(f"Terminating pip process {process.pid}")
+                    FALPackageChecker._stop_process_group(process)
+                    try:
+                        process.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        FALPackageChecker._stop_process_group(process, force=True)
+                        process.wait()
+                    break
+                
+                if pidfd is not None:
+                    select.select([pidfd], [], [], 0.25)
+                else:
+                    time.sleep(0.1)
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+    
+    @staticmethod
+    def _stop_process_group(process, force=False):
+        """Signal pip and any build subprocesses it started."""
+        try:
+            if os.name == 'nt':
+                if force:
+                    process.kill()
+                else:
+                    process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+        except OSError as e:
+            log_debug(f"Could not signal pip process {process.pid}: {str(e)}")
+    
+    @staticmethod
+    def _read_output(stream):
+        """Stream pip's output into the log line by line as it arrives."""
+        for line in iter(stream.readline, ''):
+            line = line.rstrip()
+            FALPackageChecker.latest_line = line
+            _log("PIP", line)
+            FALPackageChecker._parse_pip_progress(line)
+        stream.close()
+    
+    @staticmethod
+    def _parse_pip_progress(line):
+        """Update the progress estimate from a line of pip output."""
+        match = _PIP_STATUS_RE.match(line)
+        if match:
+            step, target = match.groups()
+            if step == "Collecting":
+                FALPackageChecker._packages_seen += 1
+            elif step == "Installing collected packages:":
+                FALPackageChecker._set_progress(90)
+                return
+            elif target == "link":
+                # --verbose repeats a download as "Downloading link ... to ..."
+                return
+            elif target.endswith(".metadata"):
+                # Metadata fetched while resolving (PEP 658), not a package
+                FALPackageChecker._fetch_active = False
+                return
+            else:
+                FALPackageChecker._fetch_active = True
+                FALPackageChecker._packages_fetched += 1
+                # A download starts empty; a cached wheel is complete at once
+                FALPackageChecker._download_fraction = 0.0 if step == "Downloading" else 1.0
+        else:
+            match = _PIP_RAW_PROGRESS_RE.match(line)
+            if not match or not FALPackageChecker._fetch_active:
+                return
+            total = float(match.group(2))
+            if total <= 0:
+                return
+            FALPackageChecker._download_fraction = min(float(match.group(1)) / total, 1.0)
+        
+        fetched = FALPackageChecker._packages_fetched - 1 + FALPackageChecker._download_fraction
+        # pip discovers dependencies as it goes, so leave room for one more
+        # package until "Installing collected packages:" ends the downloads
+        seen = FALPackageChecker._packages_seen + 1
+        FALPackageChecker._set_progress(min(90, 10 + int(80 * max(fetched, 0) / seen)))
     
     @staticmethod
     def _monitor_installation():
-        """Timer callback to update the UI during installation."""
-        if not bpy.context.scene.fal_install_in_progress:
+        """Timer callback to update the UI during installation.
+        
+        Applies whatever the install threads have queued, stops on the
+        tick that applies their final values, and polls slowly while
+        nothing arrives.
+        """
+        # Drain everything first so each property is written at most once
+        latest_progress = None
+        final = None
+        received = False
+        while True:
+            try:
+                message = _progress_q.get_nowait()
+            except queue.Empty:
+                break
+            received = True
+            if message[0] == 'progress':
+                latest_progress = message[1]
+            elif message[0] == 'final':
+                final = message
+        
+        # Timers run on the main thread, so scene writes are safe here
+        scene = bpy.context.scene
+        _flush_status()
+        
+        if final is not None:
+            _, success, install_log = final
+            scene.fal_install_log = install_log
+            scene.fal_install_success = success
+            scene.fal_install_in_progress = False
+            scene.fal_install_progress = 100 if success else 0
+        
+        if not scene.fal_install_in_progress:
             log_debug("Installation monitoring complete")
-            # Force redraw all VIEW_3D areas
-            for window in bpy.context.window_manager.windows:
-                for area in window.screen.areas:
-                    if area.type == 'VIEW_3D':
-                        area.tag_redraw()
+            FALPackageChecker._redraw()
             return None  # Stop the timer
         
-        # Update progress (simulated incremental progress)
-        current_progress = bpy.context.scene.fal_install_progress
-        if current_progress < 90:  # Reserve 90-100 for completion
-            bpy.context.scene.fal_install_progress += 1
+        redraw = False
+        if latest_progress is not None and latest_progress != scene.fal_install_progress:
+            scene.fal_install_progress = latest_progress
+            redraw = True
+        # The panel also shows pip's latest output line
+        if FALPackageChecker.latest_line != FALPackageChecker._shown_line:
+            FALPackageChecker._shown_line = FALPackageChecker.latest_line
+            redraw = True
+        if redraw:
+            FALPackageChecker._redraw()
         
-        # Force redraw all VIEW_3D areas
+        if received:
+            return FALPackageChecker._BUSY_INTERVAL
+        return FALPackageChecker._IDLE_INTERVAL
+    
+    @staticmethod
+    def _redraw():
+        """Redraw the sidebar of every 3D view, where the main panel is drawn."""
+        # Look the regions up now; pointers kept from earlier dangle once an area is closed
         for window in bpy.context.window_manager.windows:
             for area in window.screen.areas:
-                if area.type == 'VIEW_3D':
-                    area.tag_redraw()
+                if area.type != 'VIEW_3D':
+                    continue
+                for region in area.regions:
+                    if region.type == 'UI':
+                        region.tag_redraw()
+
+
+class FAL_OT_CancelInstall(bpy.types.Operator):
+    """Cancel the running FAL package installation"""
+    bl_idname = "fal.cancel_install"
+    bl_label = "Cancel Installation"
+    
+    def execute(self, context):
+        if not context.scene.fal_install_in_progress:
+            return {'CANCELLED'}
         
-        return 0.2  # Continue the timer with 0.2 second interval
+        if _install_future is None or _install_future.done():
+            # File saved mid-install: nothing is running, just clear the flag
+            context.scene.fal_install_in_progress = False
+            context.scene.fal_install_progress = 0
+            log_info("No FAL package installation is running")
+            return {'FINISHED'}
+        
+        FALPackageChecker._cancel_flag.set()
+        log_info("Cancelling FAL package installation...")
+        return {'FINISHED'}
+
+
+# Last result of get_api_key(), None until looked up
+_api_key_cache = None
+
+
+def _clear_api_key_cache(self=None, context=None):
+    """Forget the cached API key (also used as the api_key update callback)"""
+    global _api_key_cache
+    _api_key_cache = None
 
 
 # Addon preferences to store API key
@@ -217,7 +565,8 @@ class FALAddonPreferences(bpy.types.AddonPreferences):
         name="FAL API Key",
         description="API Key for FAL service",
         default="",
-        subtype='PASSWORD'
+        subtype='PASSWORD',
+        update=_clear_api_key_cache
     )
     
     def draw(self, context):
@@ -228,6 +577,14 @@ class FALAddonPreferences(bpy.types.AddonPreferences):
 
 def get_api_key():
     """Get API key from addon preferences, then fall back to environment variable"""
+    global _api_key_cache
+    if _api_key_cache is None:
+        _api_key_cache = _lookup_api_key()
+    return _api_key_cache
+
+
+def _lookup_api_key():
+    """Look up the API key without using the cache"""
     log_debug("Getting API key")
     # First try to get from addon preferences
     try:
@@ -254,6 +611,7 @@ def get_api_key():
 def set_api_key(value):
     """Set API key in both addon preferences and environment variable"""
     log_debug("Setting API key")
+    _clear_api_key_cache()
     # Save to addon preferences
     try:
         prefs = bpy.context.preferences.addons[__name__].preferences
@@ -275,91 +633,112 @@ def set_api_key(value):
 
 class FALMeshProcessor:
     @staticmethod
-    def process_mesh(obj):
+    def process_mesh(obj, merge_distance=0.0001):
         """Process the mesh with cleanup operations"""
+        import bmesh
+        
         if obj.type != 'MESH':
             return
         
-        # Enter edit mode
-        bpy.ops.object.mode_set(mode='EDIT')
-        
-        # Get the bmesh
-        bm = bmesh.from_edit_mesh(obj.data)
+        # Work on the mesh data directly; edit mode would hold stale data
+        if obj.mode == 'EDIT':
+            bpy.ops.object.mode_set(mode='OBJECT')
         
-        # Merge vertices by distance
-        bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=0.0001)
+        mesh = obj.data
+        location = obj.matrix_basis.to_translation()
         
-        # Update the mesh
-        bmesh.update_edit_mesh(obj.data)
-        
-        # Return to object mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
-        # Set origin to bottom center
-        bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS')
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+        bm = bmesh.new()
+        try:
+            bm.from_mesh(mesh)
+            
+            # Merge vertices by distance
+            bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=merge_distance)
+            
+            # Apply rotation and scale to the vertices
+            bm.transform(obj.matrix_basis.to_3x3().to_4x4())
+            
+            # Move the geometry so its bottom center sits at the origin
+            bottom_center = Vector()
+            if bm.verts:
+                coords = [v.co for v in bm.verts]
+                xs = [co.x for co in coords]
+                ys = [co.y for co in coords]
+                bottom_center = Vector((
+                    (min(xs) + max(xs)) / 2,
+                    (min(ys) + max(ys)) / 2,
+                    min(co.z for co in coords)
+                ))
+                bmesh.ops.translate(bm, vec=-bottom_center, verts=bm.verts)
+            
+            bm.to_mesh(mesh)
+        finally:
+            bm.free()
+        mesh.update()
         
-        # Move to ground plane
-        obj.location.z = 0
+        # Origin at the bottom center, resting on the ground plane
+        obj.matrix_basis = Matrix.Translation((
+            location.x + bottom_center.x,
+            location.y + bottom_center.y,
+            0.0
+        ))
 
 
-class FALImageGenPreferences(bpy.types.PropertyGroup):
-    save_directory: bpy.props.StringProperty(
+# Properties of FALImageGenPreferences, defined once as its annotations
+_IMAGE_GEN_PROPS_ANNOTATIONS = {
+    "save_directory": bpy.props.StringProperty(
         name="Save Directory",
         description="Directory to save generated images",
         default="",
         subtype='DIR_PATH'
-    )
-    
-    prompt: bpy.props.StringProperty(
+    ),
+    "prompt": bpy.props.StringProperty(
         name="Prompt",
         description="Text prompt for image generation",
         default=""
-    )
-    
-    negative_prompt: bpy.props.StringProperty(
+    ),
+    "negative_prompt": bpy.props.StringProperty(
         name="Negative Prompt",
         description="Negative prompt for image generation",
         default=""
-    )
-    
-    image_width: bpy.props.IntProperty(
+    ),
+    "image_width": bpy.props.IntProperty(
         name="Width",
         description="Generated image width",
         default=1024,
         min=512,
         max=2048
-    )
-    
-    image_height: bpy.props.IntProperty(
+    ),
+    "image_height": bpy.props.IntProperty(
         name="Height", 
         description="Generated image height",
         default=1024,
         min=512,
         max=2048
-    )
-    
-    num_inference_steps: bpy.props.IntProperty(
+    ),
+    "num_inference_steps": bpy.props.IntProperty(
         name="Steps",
         description="Number of inference steps",
         default=28,
         min=1,
         max=100
-    )
-    
-    enable_safety_checker: bpy.props.BoolProperty(
+    ),
+    "enable_safety_checker": bpy.props.BoolProperty(
         name="Enable Safety Checker",
         description="Enable content safety checking",
         default=True
-    )
-    
-    merge_distance: bpy.props.FloatProperty(
+    ),
+    "merge_distance": bpy.props.FloatProperty(
         name="Merge Distance",
         description="Distance for merging vertices",
         default=0.0001,
         min=0.00001,
         max=0.1
     )
+}
+
+
+class FALImageGenPreferences(bpy.types.PropertyGroup):
+    __annotations__ = _IMAGE_GEN_PROPS_ANNOTATIONS
 
 
 class FAL_PT_MainPanel(bpy.types.Panel):
@@ -373,12 +752,22 @@ class FAL_PT_MainPanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         scene = context.scene
-        prefs = context.preferences.addons[__name__].preferences
         
         # Package installation section
-        if not FALPackageChecker.is_package_installed():
+        if not _fal_installed:
             layout.label(text="FAL package not installed", icon='ERROR')
-            layout.operator("fal.install_package", text="Install FAL Package")
+            if scene.fal_install_in_progress:
+                layout.prop(scene, "fal_install_progress")
+                # Latest pip output line, refreshed by the install monitor
+                if FALPackageChecker.latest_line:
+                    layout.label(text=FALPackageChecker.latest_line)
+                layout.operator("fal.cancel_install", text="Cancel Installation")
+            elif not FALPackageChecker._target_writable:
+                layout.label(text="Cannot write to Blender's modules folder:", icon='ERROR')
+                layout.label(text=FALPackageChecker._install_target)
+            else:
+                layout.operator("fal.install_package", text="Install FAL Package")
+                layout.prop(scene, "fal_verbose_install")
             return
         
         # API key section
@@ -387,23 +776,45 @@ class FAL_PT_MainPanel(bpy.types.Panel):
             layout.operator("fal.update_api_key", text="Set API Key")
             return
         
+        # Settings and the generate button are in FAL_PT_SettingsPanel, which
+        # Blender draws after this layout
+
+
+class FAL_PT_SettingsPanel(bpy.types.Panel):
+    """Image generation and mesh processing settings"""
+    bl_label = "Settings"
+    bl_idname = "FAL_PT_settings_panel"
+    bl_parent_id = "FAL_PT_main_panel"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'FAL AI'
+    
+    @classmethod
+    def poll(cls, context):
+        # Shown once the main panel's install and API key checks pass
+        return _fal_installed and bool(get_api_key())
+    
+    def draw(self, context):
+        layout = self.layout
+        image_gen = context.scene.fal_image_gen
+        
         # Image generation settings
         box = layout.box()
         box.label(text="Image Generation Settings", icon='IMAGE_DATA')
         
-        box.prop(scene.fal_image_gen, "prompt")
-        box.prop(scene.fal_image_gen, "negative_prompt")
-        box.prop(scene.fal_image_gen, "image_width")
-        box.prop(scene.fal_image_gen, "image_height")
-        box.prop(scene.fal_image_gen, "num_inference_steps")
-        box.prop(scene.fal_image_gen, "enable_safety_checker")
+        box.prop(image_gen, "prompt")
+        box.prop(image_gen, "negative_prompt")
+        box.prop(image_gen, "image_width")
+        box.prop(image_gen, "image_height")
+        box.prop(image_gen, "num_inference_steps")
+        box.prop(image_gen, "enable_safety_checker")
         
         # Mesh processing settings
         box = layout.box()
         box.label(text="Mesh Processing", icon='MESH_DATA')
-        box.prop(scene.fal_image_gen, "merge_distance")
+        box.prop(image_gen, "merge_distance")
         
-        # Generate button
+        # Generate button below the settings it uses
         layout.operator("fal.generate_image", text="Generate Image and Convert to 3D")
 
 
@@ -426,7 +837,7 @@ class FAL_OT_GenerateImage(bpy.types.Operator):
             obj = self.create_image_plane(context, image_path)
             
             # Process mesh
-            FALMeshProcessor.process_mesh(obj)
+            FALMeshProcessor.process_mesh(obj, prefs.merge_distance)
             
             return {'FINISHED'}
         except Exception as e:
@@ -434,113 +845,158 @@ class FAL_OT_GenerateImage(bpy.types.Operator):
             return {'CANCELLED'}
 
 
-def register():
-    """Register the addon and all its classes"""
-    log_debug("Registering FAL AI Image to 3D addon")
-    
-    # Register properties
-    bpy.types.Scene.fal_api_key_input = bpy.props.StringProperty(
+def _pip_supports_raw_progress():
+    """Check whether the bundled pip has "--progress-bar raw" (added in pip 24.1)"""
+    # Imported here: scanning installed distributions is only needed to install
+    import importlib.metadata
+    try:
+        major, minor = importlib.metadata.version("pip").split(".")[:2]
+        return (int(major), int(minor)) >= (24, 1)
+    except (importlib.metadata.PackageNotFoundError, ValueError) as e:
+        log_debug(f"Could not determine pip version: {str(e)}")
+        return False
+
+
+# Scene properties registered by this addon, besides fal_image_gen
+_SCENE_PROPS = {
+    "fal_api_key_input": bpy.props.StringProperty(
         name="FAL API Key",
         description="API Key for FAL service",
         default="",
         subtype='PASSWORD'
-    )
-    
-    bpy.types.Scene.fal_install_log = bpy.props.StringProperty(
+    ),
+    "fal_install_log": bpy.props.StringProperty(
         name="Installation Log",
         default=""
-    )
-    
-    bpy.types.Scene.fal_debug_log = bpy.props.StringProperty(
-        name="Debug Log",
-        default="[DEBUG] FAL AI Image to 3D debug log initialized"
-    )
-    
-    bpy.types.Scene.fal_install_success = bpy.props.BoolProperty(
+    ),
+    "fal_install_success": bpy.props.BoolProperty(
         name="Installation Success",
         default=False
-    )
-    
-    bpy.types.Scene.fal_install_in_progress = bpy.props.BoolProperty(
+    ),
+    "fal_install_in_progress": bpy.props.BoolProperty(
         name="Installation In Progress",
         default=False
-    )
-    
-    bpy.types.Scene.fal_install_progress = bpy.props.IntProperty(
+    ),
+    "fal_install_progress": bpy.props.IntProperty(
         name="Installation Progress",
         default=0,
         min=0,
         max=100,
         subtype='PERCENTAGE'
-    )
-    
-    bpy.types.Scene.fal_install_pid = bpy.props.IntProperty(
-        name="Installation Process ID",
-        default=-1
-    )
-    
-    bpy.types.Scene.fal_status_message = bpy.props.StringProperty(
+    ),
+    "fal_verbose_install": bpy.props.BoolProperty(
+        name="Verbose Installation Log",
+        description="Pass --verbose to pip when installing the FAL package",
+        default=False
+    ),
+    "fal_status_message": bpy.props.StringProperty(
         name="Status Message",
         default=""
     )
+}
+
+# Classes registered and unregistered together by register()/unregister()
+_classes = (
+    FALImageGenPreferences,
+    FALAddonPreferences,
+    FAL_PT_MainPanel,
+    FAL_PT_SettingsPanel,
+    FAL_OT_GenerateImage,
+    FAL_OT_CancelInstall
+)
+_register_classes, _unregister_classes = bpy.utils.register_classes_factory(_classes)
+
+
+def register():
+    """Register the addon and all its classes"""
+    global _log_file, _executor, _fal_installed, _props_ready
+    # One log per Blender process, so simultaneous instances don't share a file
+    log_dir = bpy.utils.user_resource('CONFIG', path=__name__, create=True)
+    _prune_debug_logs(log_dir)
+    log_path = os.path.join(log_dir, f"fal_debug_{os.getpid()}.log")
+    try:
+        _log_file = open(log_path, 'w', buffering=8192)
+    except OSError as e:
+        print(f"[FAL_ERROR] Could not open debug log file {log_path}: {str(e)}")
+    log_debug("Registering FAL AI Image to 3D addon")
     
-    # Register new image generation preferences
-    bpy.utils.register_class(FALImageGenPreferences)
-    bpy.types.Scene.fal_image_gen = bpy.props.PointerProperty(type=FALImageGenPreferences)
+    _executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="fal-io")
+    
+    # Resolve the install target once; it does not change while Blender runs
+    install_target = bpy.utils.user_resource('SCRIPTS', path="modules", create=True)
+    FALPackageChecker._install_target = install_target
+    FALPackageChecker._target_writable = os.access(install_target, os.W_OK)
+    log_debug(f"Install target: {install_target} (writable: {FALPackageChecker._target_writable})")
+    # Blender only adds this folder to sys.path if it existed at startup
+    if install_target not in sys.path:
+        sys.path.append(install_target)
+    
+    _fal_installed = FALPackageChecker.is_package_installed()
+    
+    # Register properties
+    for name, prop in _SCENE_PROPS.items():
+        setattr(bpy.types.Scene, name, prop)
     
     # Register classes
-    classes = (
-        FALAddonPreferences,
-        FAL_PT_MainPanel,
-        FAL_OT_GenerateImage,
-        FALImageGenPreferences
-    )
+    try:
+        _register_classes()
+        log_debug("Successfully registered classes")
+    except Exception as e:
+        log_error(f"Failed to register classes: {str(e)}")
     
-    for cls in classes:
-        try:
-            bpy.utils.register_class(cls)
-            log_debug(f"Successfully registered class: {cls.__name__}")
-        except Exception as e:
-            log_error(f"Failed to register class {cls.__name__}: {str(e)}")
+    # Image generation preferences; the PropertyGroup must be registered first
+    bpy.types.Scene.fal_image_gen = bpy.props.PointerProperty(type=FALImageGenPreferences)
     
     log_info("FAL AI Image to 3D addon registration complete")
+    # Set last: the context is restricted while register() runs
+    _props_ready = True
 
 
 def unregister():
     """Unregister the addon and all its classes"""
+    global _props_ready, _log_file, _status_timer_pending, _executor
+    _props_ready = False
+    _clear_api_key_cache()
+    # Both timers read scene properties that are about to be removed
+    for timer in (_flush_status_timer, FALPackageChecker._monitor_installation):
+        if bpy.app.timers.is_registered(timer):
+            bpy.app.timers.unregister(timer)
+    _status_timer_pending = False
     log_debug("Unregistering FAL AI Image to 3D addon")
     
-    # Unregister classes in reverse order
-    classes = (
-        FAL_OT_GenerateImage,
-        FAL_PT_MainPanel,
-        FALAddonPreferences,
-        FALImageGenPreferences
-    )
+    # Remove the pointer before its PropertyGroup is unregistered
+    try:
+        del bpy.types.Scene.fal_image_gen
+    except Exception as e:
+        log_error(f"Failed to unregister image generation preferences: {str(e)}")
     
-    for cls in classes:
-        try:
-            bpy.utils.unregister_class(cls)
-            log_debug(f"Successfully unregistered class: {cls.__name__}")
-        except Exception as e:
-            log_error(f"Failed to unregister class {cls.__name__}: {str(e)}")
+    # Unregister classes (in reverse order)
+    try:
+        _unregister_classes()
+        log_debug("Successfully unregistered classes")
+    except Exception as e:
+        log_error(f"Failed to unregister classes: {str(e)}")
     
     # Unregister properties
     try:
-        del bpy.types.Scene.fal_api_key_input
-        del bpy.types.Scene.fal_install_log
-        del bpy.types.Scene.fal_debug_log
-        del bpy.types.Scene.fal_install_success
-        del bpy.types.Scene.fal_install_in_progress
-        del bpy.types.Scene.fal_install_progress
-        del bpy.types.Scene.fal_install_pid
-        del bpy.types.Scene.fal_image_gen
-        del bpy.types.Scene.fal_status_message
+        for name in _SCENE_PROPS:
+            delattr(bpy.types.Scene, name)
         log_debug("Successfully unregistered properties")
     except Exception as e:
         log_error(f"Failed to unregister properties: {str(e)}")
     
+    # Stop a running install; don't block Blender waiting for the workers
+    FALPackageChecker._cancel_flag.set()
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    
     log_info("FAL AI Image to 3D addon unregistration complete")
+    
+    # Detach before closing so late messages from other threads skip the file
+    log_file, _log_file = _log_file, None
+    if log_file is not None:
+        log_file.close()
 
 
 # Only register if running as an addon